@@ -12,19 +12,21 @@ https://www.originlab.com/doc/LabTalk/ref/
     e.g. changing axis scales, font sizes, etc.
 """
 
+import contextlib
 import os
 import re
 import time
-import warningszw
+import warnings
 
 import matplotlib
 import matplotlib.colors as colors
-import matplotlib.pyplot as plt
 import numpy as np
 import OriginExt
 import originpro as op
-import win32com.client
-from matplotlib.axes import ErrorbarContainer, BarContainer
+import pandas as pd
+import pythoncom
+import win32com.server.util
+from matplotlib.container import BarContainer, ErrorbarContainer
 
 __version__ = "0.1.2"
 
@@ -36,29 +38,296 @@ __version__ = "0.1.2"
 # - support for errorbars
 
 
+# Conversion of matplotlib markers and line styles to origin
+# Symbols
+# https://www.originlab.com/doc/LabTalk/ref/List-of-Symbol-Shapes
+# https://www.originlab.com/doc/LabTalk/ref/Options_for_Symbols
+# 0 = no symbol, 1 = square, 2 = circle, 3 = up triangle, 4 = down triangle,
+# 5 = diamond, 6 = cross (+), 7 = cross (x), 8 = star (*), 9 = bar (-), 10 = bar (|),
+# 11 = number, 12 = LETTER, 13 = letter, 14 = right arrow, 15 = left triangle,
+# 16 = right triangle, 17 = hexagon, 18 = star, 19 = pentagon, 20 = sphere
+# Symbol interior
+# 0 = no symbol, 1 = solid, 2 = open, 3 = dot center, 4 = hollow, 5 = + center,
+# 6 = x center, 7 = - center, 8 = | center, 9 = half up, 10 = half right,
+# 11 = half down, 12 = half left
+# https://matplotlib.org/api/markers_api.html
+_MPL_SYM = {'s': '1', 'o': '2', '^': '3', 'v': '4', 'D': '5', '+': '6', 'x': '7',
+            '*': '8', '_': '9', '|': '10', 'h': '17', 'p': '19'}
+_MPL_LINE = {'-': '0', '--': '1', ':': '2', '-.': '3'}
+
+
 class SkipSave():
     pass
 
 
-def set_axis_scale(gl, axis='x', scale='linear'):
+# Origin session opened by connect_to_origin
+_ORIGIN_SESSION = None
+
+
+# Column types for wks.col.type
+# (1 = Y, 2 = disregard, 3 = Y Error, 4 = X, 5 = Label, 6 = Z, and 7 = X Error.)
+# These are one larger than the values of the COM Column.Type property
+# https://www.originlab.com/doc/LabTalk/ref/Wks-Col-obj
+_COL_TYPE = {
+    'x': 4,
+    'y': 1,
+    'x_err': 7,
+    'y_err': 3,
+    'label': 5,
+    'z': 6,
+    'ignore': 2}
+
+
+# COM column properties of the header rows
+_COL_LABEL_ROW = {'L': 'LongName', 'U': 'Units', 'C': 'Comments'}
+
+
+# Matplotlib mathtext ($...$), converted to origin's \q(...)
+_MATHRX = re.compile(r"\$(.+?)\$")
+
+
+def _clean_label(s):
+    # Convert a matplotlib label to origin format
+    # Labels starting with "_" are hidden in matplotlib (e.g. "_child0")
+    if not s or s.startswith("_"):
+        return ""
+    return _MATHRX.sub(r"\\q(\1)", s)
+
+
+class _BulkMessageFilter():
+    # OLE message filter used while sending many COM calls to origin
+    # Rejected calls are retried immediately instead of after the
+    # default wait, for up to 60 s
+    # https://learn.microsoft.com/windows/win32/api/objidl/nn-objidl-imessagefilter
+    _com_interfaces_ = [getattr(pythoncom, 'IID_IMessageFilter', None)]
+    _public_methods_ = [
+        'HandleInComingCall', 'RetryRejectedCall', 'MessagePending']
+
+    def HandleInComingCall(self, dwCallType, htaskCaller, dwTickCount,
+                           lpInterfaceInfo):
+        return 0  # SERVERCALL_ISHANDLED
+
+    def RetryRejectedCall(self, htaskCallee, dwTickCount, dwRejectType):
+        if dwRejectType == 2 and dwTickCount < 60000:  # SERVERCALL_RETRYLATER
+            return 0  # retry immediately
+        return -1  # cancel the call
+
+    def MessagePending(self, htaskCallee, dwTickCount, dwPendingType):
+        return 2  # PENDINGMSG_WAITDEFPROCESS
+
+
+@contextlib.contextmanager
+def _origin_bulk_mode():
+    # Install _BulkMessageFilter for the duration of a bulk export and
+    # restore the previous filter on exit. Does nothing if pywin32 does not
+    # support message filters or the filter cannot be registered.
+    register = getattr(pythoncom, 'CoRegisterMessageFilter', None)
+    iid = getattr(pythoncom, 'IID_IMessageFilter', None)
+    if register is None or iid is None:
+        yield
+        return
+    try:
+        previous = register(
+            win32com.server.util.wrap(_BulkMessageFilter(), iid))
+    except pythoncom.com_error:
+        # e.g. the calling thread is not an initialized STA
+        yield
+        return
+    try:
+        yield
+    finally:
+        register(previous)
+
+
+def _to_hex(color, cache):
+    # colors.to_hex, converting each distinct color only once
+    # cache = dict shared between calls, e.g. for all lines of a figure
+    key = color if isinstance(color, str) else tuple(np.ravel(color))
+    if key not in cache:
+        cache[key] = colors.to_hex(color)
+    return cache[key]
+
+
+def _axis_values(data, axis):
+    # Convert line data to a float64 array in the units of the matplotlib axis
+    # (data may be an astropy Quantity)
+    # Quantity subclasses ndarray, so plain arrays are checked by exact type
+    if type(data) is np.ndarray and data.dtype == np.float64:
+        return data
+    if hasattr(data, "value"):
+        data = data.to(axis.get_units()).value
+    return np.asarray(data, dtype=np.float64)
+
+
+def _errorbar_yerr(container):
+    # Half length of the y error bars of an ErrorbarContainer as float64
+    # array, or None if it has no y errors.
+    # Taken from the bar lines, which (unlike the caplines) exist for any
+    # capsize; they are already in the units of the y axis.
+    # container.lines = (data_line, caplines, barlinecols), the y error bars
+    # are the last barlinecol
+    if not container.has_yerr:
+        return None
+    segments = container.lines[2][-1].get_segments()
+    return np.array([0.5 * abs(seg[-1][1] - seg[0][1]) for seg in segments],
+                    dtype=np.float64)
+
+
+def _pad_columns(columns):
+    # Stack a sequence of 1d data columns into a single (rows x columns)
+    # float64 array so it can be sent to origin in one call.
+    # Shorter columns are padded with NaN (shown as missing values in origin)
+    columns = [np.atleast_1d(np.asarray(column, dtype=np.float64))
+               for column in columns]
+    n_rows = max((len(column) for column in columns), default=0)
+    matrix = np.full((n_rows, len(columns)), np.nan,
+                     dtype=np.float64, order='F')
+    for col_idx, column in enumerate(columns):
+        matrix[:len(column), col_idx] = column
+    return matrix
+
+
+def _axis_scale_cmd(axis='x', scale='linear'):
+    # Returns the LabTalk command setting the scale of an axis,
+    # or an empty string if scale is not 'linear' or 'log'
     # axis = 'x' or 'y'
     # scale = 'linear' or 'log'
-    # graph_layer is origin graph_layer object
     # Axis label number format:
     # 1 = decimal without commas, 2 = scientific,
     # 3 = engineering, and 4 = decimal with commas (for date).
     # https://www.originlab.com/doc/LabTalk/ref/Layer-Axis-Label-obj
     if scale == 'linear':
-        gl.lt_exec('layer.' + axis + '.type = 0;')
         # Change number format to decimal
-        gl.lt_exec('layer.' + axis + '.label.numFormat=1')
+        return f'layer.{axis}.type=0; layer.{axis}.label.numFormat=1;'
     elif scale == 'log':
-        gl.lt_exec('layer.' + axis + '.type = 2;')
         # Change tick label number type to scientific
-        gl.lt_exec('layer.' + axis + '.label.numFormat=2')
+        return f'layer.{axis}.type=2; layer.{axis}.label.numFormat=2;'
+    return ''
+
+
+def set_axis_scale(gl, axis='x', scale='linear'):
+    # axis = 'x' or 'y'
+    # scale = 'linear' or 'log'
+    # graph_layer is origin graph_layer object
+    cmd = _axis_scale_cmd(axis, scale)
+    if cmd:
+        gl.lt_exec(cmd)
     return
 
 
+def _plot_style_cmds(plot_type, lc, mec, mfc, marker='None', ls='-',
+                     lw=1.0, ms=6.0, mew=1.0):
+    # Returns the set_cmd options reproducing a matplotlib line style
+    # plot_type = 'l' (line), 's' (symbol) or 'y' (line+symbol)
+    # lc, mec, mfc = line, marker edge and marker face colors (hex)
+    # marker, ls = matplotlib marker and linestyle
+    # lw, ms, mew = line width, marker size and marker edge width
+    cmds = []
+    if plot_type in ('s', 'y'):
+        cmds += [
+            f'-k {_MPL_SYM.get(marker, "0")}',  # symbol type
+            '-kf 2',  # symbol interior
+            f'-z {ms:g}',  # symbol size
+            f'-c color({mec})',  # edge color
+            f'-csf color({mfc})',  # face color
+            f'-kh {10 * mew:g}',  # edge width
+        ]
+    if plot_type == 'l':
+        cmds.append(f'-d {_MPL_LINE.get(ls, "0")}')  # linestyle
+    if plot_type in ('l', 'y'):
+        cmds += [
+            f'-cl color({lc})',  # line color
+            f'-w {500 * lw:g}',  # line width
+        ]
+    return cmds
+
+
+def _lt_safe(label):
+    # Whether a label can be pasted into a quoted LabTalk string.
+    # '"' would end the string and LabTalk substitutes %... and $(...)
+    return '"' not in label and '%' not in label and '$(' not in label
+
+
+def _column_header_cmd(long_names=None, units=None, comments=None, types=None):
+    # Returns a LabTalk script setting the header rows and types of the
+    # columns of the worksheet it is executed on, starting at the first column,
+    # and a list of (col_idx, row, label) for labels that cannot be written by
+    # LabTalk (see _lt_safe); set these with _set_column_labels.
+    # long_names, units, comments, types = lists (or None), one element per column
+    # types = 'x','y','x_err','y_err','z','label', or 'ignore'
+    cmds = []
+    unsafe = []
+    for labels, row in ((long_names, 'L'), (units, 'U'), (comments, 'C')):
+        if labels is None:
+            continue
+        for col_idx, label in enumerate(labels):
+            label = str(label)
+            if _lt_safe(label):
+                cmds.append(f'col({col_idx + 1})[{row}]$="{label}";')
+            else:
+                unsafe.append((col_idx, row, label))
+    if types is not None:
+        for col_idx, col_type in enumerate(types):
+            cmds.append(
+                f'wks.col{col_idx + 1}.type={_COL_TYPE[col_type.lower()]};')
+    return ' '.join(cmds), unsafe
+
+
+def _set_column_labels(worksheet, labels):
+    # Set header labels through the COM column properties, which accept any
+    # text. worksheet = OriginExt worksheet,
+    # labels = list of (col_idx, row, label) as returned by _column_header_cmd
+    for col_idx, row, label in labels:
+        setattr(worksheet.Columns(col_idx), _COL_LABEL_ROW[row], label)
+
+
+def _sheet_range(worksheet):
+    # Range of a worksheet in LabTalk range notation, [Book]"Sheet"!
+    book_name, sheet_name = worksheet.Parent.Name, worksheet.Name
+    if not (_lt_safe(book_name) and _lt_safe(sheet_name)):
+        raise ValueError(
+            f'cannot plot worksheet [{book_name}]{sheet_name} by LabTalk, '
+            'its name contains \'"\', \'%\' or \'$(\'')
+    return '[' + book_name + ']"' + sheet_name + '"!'
+
+
+def _multiwks_plot_cmds(worksheets, x_cols, y_cols, LineOrSym):
+    # Returns one LabTalk script per column for createGraph_multiwks,
+    # plotting that column of every worksheet and grouping the plots
+    # x_cols, y_cols, LineOrSym = lists of same length (0-based columns)
+    sheet_ranges = [_sheet_range(worksheet) for worksheet in worksheets]
+    scripts = []
+    # loop over worksheets within column loops so that data from same column
+    # can be grouped. E.g. all PL data is in same column and will be grouped.
+    for ci, x_col in enumerate(x_cols):
+        # Add data plot to graph layer
+        # list of types: https://www.originlab.com/doc/LabTalk/ref/Plot-Type-IDs
+        # 200 -- line
+        # 201 -- symbol
+        # 202 -- symbol+line
+        # If specified, plot symbol. By default, plot line
+        if LineOrSym[ci] in ['Sym', 'Symbol', 'Symbols']:
+            plot_type = 201
+        elif LineOrSym[ci] == 'Line+Sym':
+            plot_type = 202
+        else:
+            plot_type = 200
+        # (x, y) column range, column indices start at 1 in LabTalk
+        # https://www.originlab.com/doc/X-Function/ref/plotxy
+        xy = '(' + str(x_col + 1) + ',' + str(y_cols[ci] + 1) + ')'
+        script = ' '.join(
+            'plotxy iy:=' + sheet_range + xy + ' plot:=' + str(plot_type) +
+            ' ogl:=<active>;' for sheet_range in sheet_ranges)
+        # Group each column (This allows colors to be automatically incremented
+        # and a single legend entry to be created for all the data sets with
+        # the same legend entry)
+        BeginIndex = ci * len(worksheets) + 1
+        EndIndex = BeginIndex + len(worksheets) - 1
+        script += ' layer -g ' + str(BeginIndex) + ' ' + str(EndIndex) + ';'
+        scripts.append(script)
+    return scripts
+
+
 def get_graphpages(origin):
     graphpages = []
     graphnames = []
@@ -95,34 +364,32 @@ def get_sheets_from_book(origin, workbooks):
     # This can be used to get a list of worksheets which are then passed to
     # createGraph_multiwks to create graphs
     worksheets = []
-    if isinstance(workbooks, str) or isinstance(
-            workbooks, win32com.client.CDispatch):
-        wb_list = [workbooks]
-    elif isinstance(workbooks, list):
-        wb_list = workbooks
-    else:
-        print('wrong type of workbooks provided. Must be COM object, string or list')
-        return
+    wb_list = workbooks if isinstance(workbooks, (list, tuple)) else [workbooks]
     for wb in wb_list:
-        if isinstance(wb, win32com.client.CDispatch):
-            # If a COM object, this is already OK
-            pass
-        elif isinstance(wb, str):
-            # If a string, get workbook from name
-            wb = origin.WorksheetPages(workbook_name)
-        else:
-            print('wrong type of workbook provided. Must be COM object or string')
+        # If a string, get workbook from name
+        wb = origin.WorksheetPages(wb) if isinstance(wb, str) else wb
         if wb is None:
             print('workbook does not exist. Check if name is correct')
-        else:
-            for ws in wb.Layers:
-                worksheets.append(ws)
+            continue
+        try:
+            worksheets.extend(wb.Layers)
+        except AttributeError:
+            print('wrong type of workbook provided. Must be COM object or string')
     print('Found ' + str(len(worksheets)) + ' worksheets')
     return worksheets
 
 
 def connect_to_origin():
     # Connect to Origin client
+    # The connection is kept in _ORIGIN_SESSION and reused by later calls
+    # (e.g. repeated numpy_to_origin calls with origin=None)
+    global _ORIGIN_SESSION
+    if _ORIGIN_SESSION is not None:
+        try:
+            _ORIGIN_SESSION.GetLTVar("@V")  # check session is still alive
+            return _ORIGIN_SESSION
+        except Exception:
+            _ORIGIN_SESSION = None
     # OriginExt.Application() forces a new connection
     origin = OriginExt.ApplicationSI()
     origin.Visible = origin.MAINWND_SHOW  # Make session visible
@@ -132,7 +399,16 @@ def connect_to_origin():
     # Wait for origin to compile
     # https://www.originlab.com/doc/LabTalk/ref/Second-cmd#-poc.3B_Pause_up_to_the_specified_number_of_seconds_to_wait_for_Origin_OC_startup_compiling_to_finish
     origin.Execute("sec -poc 3.5")
-    time.sleep(3.5)
+    # sec -poc already waits for compiling to finish, so only poll until
+    # origin answers instead of sleeping a fixed time
+    deadline = time.monotonic() + 3.5
+    while time.monotonic() < deadline:
+        try:
+            origin.GetLTVar("@V")
+            break
+        except Exception:
+            time.sleep(0.05)
+    _ORIGIN_SESSION = origin
     return origin
 
 
@@ -179,309 +455,243 @@ def matplotlib_to_origin(
     if origin == SkipSave:
         return origin
 
-    op.attach()
-    op.set_show()
-
-    if folder_name is not None:
-        # op.pe.cd("/")
-        op.pe.mkdir(folder_name, chk=True)
-        op.pe.cd(folder_name)
-
-    # Create a workbook page
-    wkb = op.new_book('w', workbook_name)
-    wks = wkb.add_sheet(worksheet_name)
-
-    # Make graph page
-    template = os.path.join(template_path, template_name)  # Pick template
-    # Make a graph with the template
-    gp = op.new_graph(graph_name, template)
-    gl = gp[0] if gp is not None else None
-
     errobar_containers = [
         container for container in ax.containers if isinstance(
             container, ErrorbarContainer)]
 
     # line blongs to container
-    contaienr_childeren = [
-        c for container in errobar_containers for c in container.get_children()]
+    # (compared by identity, so the membership test is a set lookup)
+    container_children = {
+        id(c) for container in errobar_containers for c in container.get_children()}
 
     # extract lines
-    lines = [(line, None) for line in ax.lines if line not in contaienr_childeren] + \
+    lines = [(line, None) for line in ax.lines if id(line) not in container_children] + \
             [(container.lines[0], container)
              for container in errobar_containers]
 
-    next_idx = 0
+    # Extract the data of every line and bar first, so that all columns can
+    # be written to the worksheet at once
+    columns = []
+    column_labels = []  # (long name, comments, type) of each column
+    plot_lines = []  # (line, x_col_idx, y_col_idx, yerr_col_idx)
     for line, container in lines:
-        # extract data
-        xdata = line.get_xdata()
-        if hasattr(xdata, "value"):
-            xdata = xdata.to(ax.xaxis.get_units()).value
-        ydata = line.get_ydata()
-        if hasattr(ydata, "value"):
-            ydata = ydata.to(ax.yaxis.get_units()).value
-        yerrdata = None
-
+        # Check the label and kind of line before extracting any data
         if container is None:
-            label = line.get_label() if line.get_label()[0] != "_" else ''
-            label = re.sub(r"\$(.+?)\$", r"\\q(\1)", label)
-
-            # Indices for x and y columns
-            x_col_idx = next_idx
-            y_col_idx = next_idx + 1
-            yerr_col_idx = -1
-            next_idx += 2
-
+            label = _clean_label(line.get_label())
         elif isinstance(container, matplotlib.container.ErrorbarContainer):
-            label = container.get_label() if container.get_label() is not None else ''
-            label = re.sub(r"\$(.+?)\$", r"\\q(\1)", label)
-
+            label = _clean_label(container.get_label())
             line = container.lines[0]
-            # Indices for x, y and yerr columns
-            x_col_idx = next_idx
-            y_col_idx = next_idx + 1
-            yerr_col_idx = next_idx + 2
-            next_idx += 3
-
-            yerrldata = container.lines[1][0].get_ydata()
-            yerrudata = container.lines[1][1].get_ydata()
-            yerrdata = (yerrudata - yerrldata) / 2
-            if hasattr(yerrdata, "value"):
-                yerrdata = yerrdata.to(ax.yaxis.get_units()).value
-
         else:
             warnings.warn(f"unknown container {container}")
             continue
 
-        # Add data to sheet
-        wks.from_list(
-            x_col_idx,
-            np.float64(xdata).tolist(),
-            'X',
-            units='Unit',
-            comments='',
-            axis='X')
-        wks.from_list(
-            y_col_idx,
-            np.float64(ydata).tolist(),
-            'Y',
-            units='Unit',
-            comments=label,
-            axis='Y')
+        # extract data
+        xdata = _axis_values(line.get_xdata(), ax.xaxis)
+        ydata = _axis_values(line.get_ydata(), ax.yaxis)
+        yerrdata = None
+        if container is not None:
+            yerrdata = _errorbar_yerr(container)
+
+        # Indices for x, y and yerr columns
+        x_col_idx = len(columns)
+        y_col_idx = x_col_idx + 1
+        columns += [xdata, ydata]
+        column_labels += [('X', '', 'x'), ('Y', label, 'y')]
         if yerrdata is not None:
-            wks.from_list(
-                yerr_col_idx,
-                np.float64(yerrdata).tolist(),
-                'Yerr',
-                units='Unit',
-                comments='',
-                axis='E')
-
-        # Add data plot to graph layer
-        # 200 -- line
-        # 201 -- symbol
-        # 202 -- symbol+line
-        # Symbols
-        # https://www.originlab.com/doc/LabTalk/ref/List-of-Symbol-Shapes
-        # https://www.originlab.com/doc/LabTalk/ref/Options_for_Symbols
-        # 0 = no symbol, 1 = square, 2 = circle, 3 = up triangle, 4 = down triangle,
-        # 5 = diamond, 6 = cross (+), 7 = cross (x), 8 = star (*), 9 = bar (-), 10 = bar (|),
-        # 11 = number, 12 = LETTER, 13 = letter, 14 = right arrow, 15 = left triangle,
-        # 16 = right triangle, 17 = hexagon, 18 = star, 19 = pentagon, 20 = sphere
-        # Symbol interior
-        # 0 = no symbol, 1 = solid, 2 = open, 3 = dot center, 4 = hollow, 5 = + center,
-        # 6 = x center, 7 = - center, 8 = | center, 9 = half up, 10 = half right,
-        # 11 = half down, 12 = half left
-        # https://matplotlib.org/api/markers_api.html
-        mpl_sym_conv = {'s': '1', 'o': '2', '^': '3', 'v': '4', 'D': '5', '+': '6', 'x': '7',
-                        '*': '8', '_': '9', '|': '10', 'h': '17', 'p': '19'}
-        mpl_line_conv = {'-': '0', '--': '1', ':': '2', '-.': '3'}
-
-        # p.symbol_kind = 2
-
-        # 'l'(Line Plot) 's'(Scatter Plot) 'y' (Line Symbols) 'c' (Column) '?' auto(template)
-        # Line
-        if plt.getp(line, 'marker') == 'None':
-            p = gl.add_plot(
-                wks,
-                y_col_idx,
-                x_col_idx,
-                type="l",
-                colyerr=yerr_col_idx)
-            lc = colors.to_hex(plt.getp(line, 'color'))
-            # Set line color and line width
-            p.set_cmd(
-                # linestyle
-                '-d ' + mpl_line_conv.get(plt.getp(line, 'linestyle'), '0'),
-                '-cl color(' + lc + ')',
-                '-w 500*' + str(plt.getp(line, 'linewidth'))  # line width
-            )
-
-        # Symbol
-        elif plt.getp(line, 'linestyle') == 'None':
-            p = gl.add_plot(
-                wks,
-                y_col_idx,
-                x_col_idx,
-                type="s",
-                colyerr=yerr_col_idx)
-            # Set symbol size, edge color, face color
-            mec = colors.to_hex(plt.getp(line, 'mec'))
-            mfc = colors.to_hex(plt.getp(line, 'mfc'))
-            p.set_cmd(
-                # symbol type
-                '-k ' + mpl_sym_conv.get(plt.getp(line, 'marker'), '0'),
-                '-kf 2',  # symbol interior
-                '-z ' + str(plt.getp(line, 'ms')),  # symbol size
-                '-c color(' + mec + ')',  # face color
-                '-csf color(' + mfc + ')',  # edge color
-                '-kh 10*' + str(plt.getp(line, 'mew'))  # edge width
-            )
-
-        # Line+Symbol
+            yerr_col_idx = len(columns)
+            columns.append(yerrdata)
+            column_labels.append(('Yerr', '', 'y_err'))
         else:
-            p = gl.add_plot(
-                wks,
-                y_col_idx,
-                x_col_idx,
-                type="y",
-                colyerr=yerr_col_idx)
-            # Set symbol size, edge color, face color
-            lc = colors.to_hex(plt.getp(line, 'color'))
-            mec = colors.to_hex(plt.getp(line, 'mec'))
-            mfc = colors.to_hex(plt.getp(line, 'mfc'))
-            p.set_cmd(
-                # symbol type
-                '-k ' + mpl_sym_conv[plt.getp(line, 'marker')],
-                '-kf 2',  # symbol interior
-                '-z ' + str(plt.getp(line, 'ms')),  # symbol size
-                '-c color(' + mec + ')',  # edge color
-                '-csf color(' + mfc + ')',  # face color
-                # edge width
-                '-kh 10*' + str(plt.getp(line, 'mew')),
-                '-cl color(' + lc + ')',  # line color
-                '-w 500*' + str(plt.getp(line, 'linewidth')),  # line width
-            )
-
-        gl.rescale()
+            yerr_col_idx = -1
+        plot_lines.append((line, x_col_idx, y_col_idx, yerr_col_idx))
 
     bar_containers = [
         container for container in ax.containers if isinstance(
             container, BarContainer)]
+    bar_plots = []  # (container, x_col_idx, y_col_idx)
+    text_columns = {}  # col_idx: list of strings
     if len(bar_containers) > 1:
-        x_col_idx = next_idx
-        y_col_idx = next_idx + 1
+        # Bars share one x column holding the tick labels
+        x_col_idx = len(columns)
         xdata = [[label.get_position()[0], label.get_text()]
                  for label in ax.get_xticklabels()]
         xdata = sorted(xdata, key=lambda x: x[0])
-        xdata = np.array([v for _, v in xdata])
-
-        wks.from_list(
-            x_col_idx,
-            xdata.tolist(),
-            'X',
-            units='Unit',
-            comments='',
-            axis='X')
-
-        for i, container in enumerate(bar_containers):
-            label = container.get_label()
+        text_columns[x_col_idx] = [v for _, v in xdata]
+        # placeholder, replaced by the text column below
+        columns.append(np.full(len(xdata), np.nan))
+        column_labels.append(('X', '', 'x'))
+
+        for container in bar_containers:
+            label = _clean_label(container.get_label())
             ydata = [[c.get_x(), c.get_height()]
                      for c in container.get_children()]
             ydata = sorted(ydata, key=lambda x: x[0])
-            ydata = np.array([v for _, v in ydata])
-
-            wks.from_list(
-                y_col_idx + i,
-                np.float64(ydata).tolist(),
-                'Y',
-                units='Unit',
-                comments=label,
-                axis='Y')
-
+            bar_plots.append((container, x_col_idx, len(columns)))
+            columns.append(np.array([v for _, v in ydata]))
+            column_labels.append(('Y', label, 'y'))
+
+    # Nothing to export, skip creating the workbook and graph
+    if not columns:
+        return op
+
+    with _origin_bulk_mode():
+        op.attach()
+        op.set_show()
+
+        if folder_name is not None:
+            # op.pe.cd("/")
+            op.pe.mkdir(folder_name, chk=True)
+            op.pe.cd(folder_name)
+
+        # Create a workbook page
+        wkb = op.new_book('w', workbook_name)
+        wks = wkb.add_sheet(worksheet_name)
+
+        # Make graph page
+        template = os.path.join(template_path, template_name)  # Pick template
+        # Make a graph with the template
+        gp = op.new_graph(graph_name, template)
+        gl = gp[0] if gp is not None else None
+
+        # Add data to sheet in a single call, then set the column headers.
+        # Graph plots are only added afterwards, so no data is sent in between
+        # The column-major (Fortran order) array is wrapped without a copy
+        frame = pd.DataFrame(_pad_columns(columns), copy=False)
+        for col_idx, text in text_columns.items():
+            frame[col_idx] = pd.Series(text, dtype=object)
+        wks.from_df(frame)
+        long_names, comments, types = zip(*column_labels)
+        cmd, unsafe_labels = _column_header_cmd(
+            long_names, ['Unit'] * len(columns), comments, types)
+        wks.lt_exec(cmd)
+        _set_column_labels(wks.obj, unsafe_labels)
+
+        hex_colors = {}  # hex of each color, shared between lines and bars
+        for line, x_col_idx, y_col_idx, yerr_col_idx in plot_lines:
+            # Add data plot to graph layer
+            # 200 -- line
+            # 201 -- symbol
+            # 202 -- symbol+line
+            # Symbol and line style conversions are defined in _MPL_SYM, _MPL_LINE
+            # and applied in _plot_style_cmds
+
+            # p.symbol_kind = 2
+
+            # 'l'(Line Plot) 's'(Scatter Plot) 'y' (Line Symbols) 'c' (Column) '?' auto(template)
+            # Line properties
+            marker = line.get_marker()
+            ls = line.get_linestyle()
+            lw = line.get_linewidth()
+            ms = line.get_markersize()
+            mew = line.get_markeredgewidth()
+            lc = _to_hex(line.get_color(), hex_colors)
+            mec = _to_hex(line.get_markeredgecolor(), hex_colors)
+            mfc = _to_hex(line.get_markerfacecolor(), hex_colors)
+
+            if marker == 'None':
+                plot_type = 'l'  # Line
+            elif ls == 'None':
+                plot_type = 's'  # Symbol
+            else:
+                plot_type = 'y'  # Line+Symbol
             p = gl.add_plot(
                 wks,
-                y_col_idx + i,
+                y_col_idx,
                 x_col_idx,
-                type="c")
-            mfc = colors.to_hex(plt.getp(container[0], "facecolor"))
-            p.set_cmd(
-                '-cf color(' + mfc + ')',  # face color
-            )
-
-        g = gl.group(True, 0, len(bar_containers) - 1)
-        next_idx += len(bar_containers) + 1
+                type=plot_type,
+                colyerr=yerr_col_idx)
+            p.set_cmd(*_plot_style_cmds(
+                plot_type, lc, mec, mfc,
+                marker=marker, ls=ls, lw=lw, ms=ms, mew=mew))
+
+        # Add bar plots to graph layer
+        if bar_plots:
+            for container, x_col_idx, y_col_idx in bar_plots:
+                p = gl.add_plot(
+                    wks,
+                    y_col_idx,
+                    x_col_idx,
+                    type="c")
+                mfc = _to_hex(container[0].get_facecolor(), hex_colors)
+                p.set_cmd(f'-cf color({mfc})')  # face color
+            g = gl.group(True, 0, len(bar_plots) - 1)
+
         gl.rescale()
 
-    # For labtalk documentation of graph formatting, see:
-    # https://www.originlab.com/doc/LabTalk/guide/Formatting-Graphs
-    # https://www.originlab.com/doc/LabTalk/ref/Layer-Axis-Label-obj
-    # For matplotlib documentation, see:
-    # https://matplotlib.org/api/axes_api.html
-    # Get figure dimensions
-    # Set figure dimensions
-    # Get axes ranges
-    x_axis_range = ax.get_xlim()
-    y_axis_range = ax.get_ylim()
-    # Get axes scale types
-    x_axis_scale = ax.get_xscale()
-    y_axis_scale = ax.get_yscale()
-    # Get axes labels
-    x_axis_label = ax.get_xlabel()
-    x_axis_label = re.sub(r"\$(.+?)\$", r"\\q(\1)", x_axis_label)
-    y_axis_label = ax.get_ylabel()
-    y_axis_label = re.sub(r"\$(.+?)\$", r"\\q(\1)", y_axis_label)
-    title = ax.get_title()
-    # Set axes titles (xb for bottom axis, yl for left y-axis, etc.)
-    gl.axis("x").title = x_axis_label
-    gl.axis("y").title = y_axis_label
-    # Set fontsizes
-    # graph_layer.Execute('layer.x.label.pt = 12;')
-    # graph_layer.Execute('layer.y.label.pt = 12;')
-    # graph_layer.Execute('xb.fsize = 16;')
-    # graph_layer.Execute('yl.fsize = 16;')
-
-    # Set axis scales
-    set_axis_scale(gl, axis='x', scale=x_axis_scale)
-    set_axis_scale(gl, axis='y', scale=y_axis_scale)
-    # Set axis ranges
-    gl.set_xlim(*x_axis_range)
-    gl.set_ylim(*y_axis_range)
-
-    # Set page dimensions based on figure size
-    # Units 1 = % page, 2 = inches, 3 = cm, 4 = mm, 5 = pixel, 6 = points, and
-    # 7 = % of linked layer.
-    figure_size_inches = fig.get_size_inches()
-    gl.set_int("unit", 2)
-    gl.set_float("width", figure_size_inches[0])
-    gl.set_float("height", figure_size_inches[1])
-    op.lt_exec("pfit2l margin:=tight;")
-    # graph_page.SetWidth(figure_size_inches[0])
-    # graph_page.SetHeight(figure_size_inches[1])
-    # graph_page.Execute('page.width= page.resx*'+str(figure_size_inches[0])+'; '+
-    # 'page.height= page.resy*'+str(figure_size_inches[1])+';')
-    # Units 1 = % page, 2 = inches, 3 = cm, 4 = mm, 5 = pixel, 6 = points, and 7 = % of linked layer.
-    # graph_layer.Execute('layer.unit=2; ' +
-    # 'layer.width='+str(figure_size_inches[0])+'; '+
-    # 'layer.height='+str(figure_size_inches[1])+';')
-    # Group each column (This allows colors to be automatically incremented
-    # and a single legend entry to be created for all the data sets with
-    # the same legend entry)
-    # graph_layer.Execute('layer -g ' + str(group_start_idx) + ' '  + str(group_end_idx) + ';')
-    # graph_layer.Execute('Rescale')
-    op.lt_exec('legend -r')  # re-construct legend
-    title = ax.get_legend()
-    # Whether ledgend exists
-    if title is None:
-        title = ""
-    else:
-        title = title.get_title().get_text()
-    # If title exsits add title
-    if title != "":
-        title = re.sub(r"\$(.+?)\$", r"\\q(\1)", title)
-        legend_text = op.get_lt_str("legend.text")
-        op.lt_exec(f"legend.text$={title}\n{legend_text};")
-
-    return op
+        # For labtalk documentation of graph formatting, see:
+        # https://www.originlab.com/doc/LabTalk/guide/Formatting-Graphs
+        # https://www.originlab.com/doc/LabTalk/ref/Layer-Axis-Label-obj
+        # For matplotlib documentation, see:
+        # https://matplotlib.org/api/axes_api.html
+        # Get figure dimensions
+        # Set figure dimensions
+        # Get axes ranges
+        x_axis_range = ax.get_xlim()
+        y_axis_range = ax.get_ylim()
+        # Get axes scale types
+        x_axis_scale = ax.get_xscale()
+        y_axis_scale = ax.get_yscale()
+        # Get axes labels
+        x_axis_label = _clean_label(ax.get_xlabel())
+        y_axis_label = _clean_label(ax.get_ylabel())
+        title = ax.get_title()
+        # Set axes titles (xb for bottom axis, yl for left y-axis, etc.)
+        gl.axis("x").title = x_axis_label
+        gl.axis("y").title = y_axis_label
+        # Set fontsizes
+        # graph_layer.Execute('layer.x.label.pt = 12;')
+        # graph_layer.Execute('layer.y.label.pt = 12;')
+        # graph_layer.Execute('xb.fsize = 16;')
+        # graph_layer.Execute('yl.fsize = 16;')
+
+        # The remaining formatting is collected into a single LabTalk script
+        # and executed at once
+        cmds = []
+        # Set axis scales
+        cmds.append(_axis_scale_cmd(axis='x', scale=x_axis_scale))
+        cmds.append(_axis_scale_cmd(axis='y', scale=y_axis_scale))
+        # Set axis ranges
+        cmds.append(
+            f'layer.x.from={x_axis_range[0]}; layer.x.to={x_axis_range[1]};')
+        cmds.append(
+            f'layer.y.from={y_axis_range[0]}; layer.y.to={y_axis_range[1]};')
+
+        # Set page dimensions based on figure size
+        # Units 1 = % page, 2 = inches, 3 = cm, 4 = mm, 5 = pixel, 6 = points, and
+        # 7 = % of linked layer.
+        figure_size_inches = fig.get_size_inches()
+        cmds.append(f'layer.unit=2; layer.width={figure_size_inches[0]}; '
+                    f'layer.height={figure_size_inches[1]};')
+        cmds.append('pfit2l margin:=tight;')
+        # graph_page.SetWidth(figure_size_inches[0])
+        # graph_page.SetHeight(figure_size_inches[1])
+        # graph_page.Execute('page.width= page.resx*'+str(figure_size_inches[0])+'; '+
+        # 'page.height= page.resy*'+str(figure_size_inches[1])+';')
+        # Units 1 = % page, 2 = inches, 3 = cm, 4 = mm, 5 = pixel, 6 = points, and 7 = % of linked layer.
+        # graph_layer.Execute('layer.unit=2; ' +
+        # 'layer.width='+str(figure_size_inches[0])+'; '+
+        # 'layer.height='+str(figure_size_inches[1])+';')
+        # Group each column (This allows colors to be automatically incremented
+        # and a single legend entry to be created for all the data sets with
+        # the same legend entry)
+        # graph_layer.Execute('layer -g ' + str(group_start_idx) + ' '  + str(group_end_idx) + ';')
+        # graph_layer.Execute('Rescale')
+        cmds.append('legend -r;')  # re-construct legend
+        gl.lt_exec(' '.join(cmd for cmd in cmds if cmd))
+
+        title = ax.get_legend()
+        # Whether ledgend exists
+        if title is None:
+            title = ""
+        else:
+            title = _clean_label(title.get_title().get_text())
+        # If title exsits add title
+        # (needs the legend text generated by the script above)
+        if title != "":
+            legend_text = op.get_lt_str("legend.text")
+            op.lt_exec(f"legend.text$={title}\n{legend_text};")
+
+        return op
 
 
 def numpy_to_origin(
@@ -506,80 +716,69 @@ def numpy_to_origin(
     # If no origin session has been passed, start a new one
     if origin is None:
         origin = connect_to_origin()
-    origin_version = get_origin_version(origin)
-    # Check if workbook exists. If not create a new workbook page with this
-    # name
-    layer_idx = None
-    if origin.WorksheetPages(workbook_name) is None:
-        workbook_name = origin.CreatePage(
-            2, workbook_name, 'Origin')  # 2 for workbook
-        # Use Sheet1 if workbook is newly made
-        layer_idx = 0
-    # get workbook instance from name
-    wb = origin.WorksheetPages(workbook_name)
-    if layer_idx is None:
-        wb.Layers.Add()  # Add a worksheet
-        # then find the last worksheet to modify (to avoid overwriting other
-        # data)
-        layer_idx = wb.Layers.Count - 1
-    ws = wb.Layers(layer_idx)  # Get worksheet instance, index starts at 0.
-    ws.Name = worksheet_name  # Set worksheet name
-    # For now, assume only x and y data for each line (ignore error data)
-    # Set number of columns in worksheet
-    ws.Cols = data_array.shape[column_axis]
-    # Change column Units, Long Name, or Comments]
-    for col_idx in range(0, data_array.shape[column_axis]):
-        col = ws.Columns(col_idx)  # Get column instance, index starts at 0
-        # Go through, check that each value exists and add to worksheet
-        if (long_names is not None) and (len(long_names) > col_idx):
-            col.LongName = long_names[col_idx]
-        if (units is not None) and (len(units) > col_idx):
-            col.Units = units[col_idx]
-        if (comments is not None) and (len(comments) > col_idx):
-            col.Comments = comments[col_idx]
-        if not (types is None) and (len(types) > col_idx):
-            type_str_to_int = {
-                'x': 3,
-                'y': 0,
-                'x_err': 6,
-                'y_err': 2,
-                'label': 4,
-                'z': 5,
-                'ignore': 1}
-            # Set column data type to (0 = Y, 1 = disregard, 2 = Y Error, 3 = X, 4 = Label, 5 = Z, and 6 = X Error.)
-            # documentation here is off by one
-            # https://www.originlab.com/doc/LabTalk/ref/Wks-Col-obj
-            col.Type = type_str_to_int[types[col_idx].lower()]
+    # Origin startup is done without the bulk message filter, which would
+    # retry calls rejected while origin is busy starting up immediately
+    with _origin_bulk_mode():
+        # Check if workbook exists. If not create a new workbook page with this
+        # name
+        wb = origin.WorksheetPages(workbook_name)
+        if wb is None:
+            workbook_name = origin.CreatePage(
+                2, workbook_name, 'Origin')  # 2 for workbook
+            # get workbook instance from name
+            wb = origin.WorksheetPages(workbook_name)
+            # Use Sheet1 if workbook is newly made
+            ws = wb.Layers(0)  # Get worksheet instance, index starts at 0.
+        else:
+            layers = wb.Layers
+            layers.Add()  # Add a worksheet
+            # then find the last worksheet to modify (to avoid overwriting
+            # other data)
+            ws = layers(layers.Count - 1)
+        ws.Name = worksheet_name  # Set worksheet name
+        # For now, assume only x and y data for each line (ignore error data)
+        # Set number of columns in worksheet
+        ws.Cols = data_array.shape[column_axis]
         # Check dimensionality off array.
         # If one dimensional, each element is assumed to be a column
         # If two dimensional, check
         # other dimensions are not supported.
         if data_array.ndim == 2:
+            # No copy if the array is already float64
+            matrix = np.asarray(data_array, dtype=np.float64)
             if column_axis == 0:
-                origin.PutWorksheet('[' + wb.Name + ']' + ws.Name, np.float64(
-                    data_array[col_idx, :]).tolist(), 0, col_idx)  # start row, start col
-            elif column_axis == 1:
-                origin.PutWorksheet('[' + wb.Name + ']' + ws.Name, np.float64(
-                    data_array[:, col_idx]).tolist(), 0, col_idx)  # start row, start col
+                matrix = matrix.T
         elif data_array.ndim == 1:
-            origin.PutWorksheet(
-                '[' + wb.Name + ']' + ws.Name,
-                np.float64(
-                    data_array[col_idx]).tolist(),
-                0,
-                col_idx)  # start row, start col
+            matrix = _pad_columns(data_array)
         else:
+            matrix = None
             print('only 1 and 2 dimensional arrays supported')
-    # origin.PutWorksheet('['+wb.Name+']'+ws.Name,
-    # np.float64(data_array).T.tolist(), 0, col_idx) # start row, start col
-    if user_defined is not None:
-        # User Param Rows
-        for idx, param in enumerate(user_defined):
-            ws.Execute('wks.UserParam' + str(idx + 1) +
-                       '=1; wks.UserParam' + str(idx + 1) + '$="' + param[0] + '";')
-            ws.Execute('col(1)[' + param[0] + ']$="' + param[1] + '";')
-        origin.Execute('wks.col1.width=10;')
-    return origin, wb, ws
+        if matrix is not None:
+            # Send all columns at once, rows along the first axis.
+            # OriginExt takes nested lists, so the whole block is converted
+            # with a single tolist() call
+            origin.PutWorksheet('[' + wb.Name + ']' + ws.Name,
+                                matrix.tolist(), 0, 0)  # start row, start col
+        # Change column Units, Long Name, Comments and types
+        # Headers are set with a single LabTalk script, except labels LabTalk
+        # cannot quote, which are set through the column properties
+        n_cols = data_array.shape[column_axis]
+        cmd, unsafe_labels = _column_header_cmd(
+            long_names=long_names[:n_cols] if long_names is not None else None,
+            units=units[:n_cols] if units is not None else None,
+            comments=comments[:n_cols] if comments is not None else None,
+            types=types[:n_cols] if types is not None else None)
+        if user_defined is not None:
+            # User Param Rows
+            for idx, param in enumerate(user_defined):
+                cmd += (' wks.UserParam' + str(idx + 1) +
+                        '=1; wks.UserParam' + str(idx + 1) + '$="' + param[0] + '";')
+                cmd += ' col(1)[' + param[0] + ']$="' + param[1] + '";'
+            cmd += ' wks.col1.width=10;'
+        if cmd:
+            ws.Execute(cmd)
+        _set_column_labels(ws, unsafe_labels)
+        return origin, wb, ws
 
 
 def createGraph_multiwks(origin, graph_name, template, templatePath, worksheets, x_cols, y_cols,
@@ -598,7 +797,6 @@ def createGraph_multiwks(origin, graph_name, template, templatePath, worksheets,
     x_scale, y_scale can be None (use origin default), "linear" or "log"
     x_label, y_label can be None (use template default) or string
     '''
-    origin_version = get_origin_version(origin)
     # Create graph page and object
     templateFullPath = os.path.join(templatePath, template)
     # Create graph if doesn't already exist
@@ -624,53 +822,10 @@ def createGraph_multiwks(origin, graph_name, template, templatePath, worksheets,
         LineOrSym = ['Line'] * len(y_cols)
     elif isinstance(LineOrSym, str):
         LineOrSym = [LineOrSym] * len(y_cols)
-    # Get dataplot collection from the graph layer
-    dataPlots = graph_layer.DataPlots
-
     # Add data column by column to the graph
-    # loop over worksheets within column loops so that data from same column
-    # can be grouped. E.g. all PL data is in same column and will be grouped.
-    for ci, x_col in enumerate(x_cols):
-        for wi, worksheet in enumerate(worksheets):
-            # Create a data range
-            # Tested only on origin 2016 and 2018
-            if origin_version < 9.5:  # 2016 or earlier
-                dr = origin.NewDataRange  # Make a new datarange
-            elif origin_version >= 9.50:  # 2018 or later
-                dr = origin.NewDataRange()
-
-            # Add data to data range
-            # worksheet, start row, start col, end row (-1=last), end col
-            dr.Add('X', worksheet, 0, x_col, -1, x_col)
-            dr.Add('Y', worksheet, 0, y_cols[ci], -1, y_cols[ci])
-            # Add data plot to graph layer
-            # list of types: https://www.originlab.com/doc/LabTalk/ref/Plot-Type-IDs
-            # 200 -- line
-            # 201 -- symbol
-            # 202 -- symbol+line
-            # If specified, plot symbol. By default, plot line
-            # https://www.originlab.com/doc/python/PyOrigin/Classes/GraphLayer-AddPlot
-            if LineOrSym[ci] in ['Sym', 'Symbol', 'Symbols']:
-                graph_layer.AddPlot(dr, 201)
-                # Method when using win32com to connect
-                # dataPlots.Add(dr, 201)
-            elif LineOrSym[ci] == 'Line+Sym':
-                graph_layer.AddPlot(dr, 202)
-                # dataPlots.Add(dr, 202)
-            else:
-                graph_layer.AddPlot(dr, 200)
-                # dataPlots.Add(dr, 200)
-        # Group each column (This allows colors to be automatically incremented
-        # and a single legend entry to be created for all the data sets with
-        # the same legend entry)
-        BeginIndex = ci * len(worksheets) + 1
-        EndIndex = BeginIndex + len(worksheets) - 1
-        graph_layer.Execute(
-            'layer -g ' +
-            str(BeginIndex) +
-            ' ' +
-            str(EndIndex) +
-            ';')
+    # All worksheets of a column are added and grouped by a single script
+    for script in _multiwks_plot_cmds(worksheets, x_cols, y_cols, LineOrSym):
+        graph_layer.Execute(script)
 
     graph_layer.Execute('legend -r')
 
@@ -0,0 +1,26 @@
+"""Stub the Windows-only origin/COM modules so py2origin can be imported."""
+import sys
+import types
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+
+def _stub(name, **attrs):
+    if name not in sys.modules:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+    return sys.modules[name]
+
+
+_stub('OriginExt')
+_stub('originpro')
+_stub('pythoncom', com_error=type('com_error', (Exception,), {}))
+_stub('win32com')
+_stub('win32com.server')
+_stub('win32com.server.util', wrap=lambda obj, iid=None: obj)
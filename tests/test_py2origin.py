@@ -1,5 +1,299 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+import py2origin
 from py2origin import __version__
 
 
 def test_version():
     assert __version__ == '0.1.2'
+
+
+def test_pad_columns():
+    matrix = py2origin._pad_columns([[1, 2, 3], [4.5], np.arange(2)])
+    assert matrix.shape == (3, 3)
+    assert matrix.dtype == np.float64
+    assert matrix.flags.f_contiguous
+    np.testing.assert_array_equal(matrix[:, 0], [1, 2, 3])
+    assert matrix[0, 1] == 4.5
+    assert np.isnan(matrix[1:, 1]).all()
+    np.testing.assert_array_equal(matrix[:2, 2], [0, 1])
+    assert np.isnan(matrix[2, 2])
+
+
+def test_pad_columns_ragged_object_array():
+    data = np.empty(2, dtype=object)
+    data[0], data[1] = np.arange(4), np.arange(2)
+    matrix = py2origin._pad_columns(data)
+    assert matrix.shape == (4, 2)
+    assert np.isnan(matrix[2:, 1]).all()
+
+
+def test_axis_scale_cmd():
+    assert py2origin._axis_scale_cmd('x', 'linear') == \
+        'layer.x.type=0; layer.x.label.numFormat=1;'
+    assert py2origin._axis_scale_cmd('y', 'log') == \
+        'layer.y.type=2; layer.y.label.numFormat=2;'
+    assert py2origin._axis_scale_cmd('x', None) == ''
+
+
+def test_column_header_cmd():
+    cmd, unsafe = py2origin._column_header_cmd(
+        long_names=['X', 'Y'], units=['s', 'm'],
+        types=['x', 'y'])
+    assert cmd == ('col(1)[L]$="X"; col(2)[L]$="Y"; '
+                   'col(1)[U]$="s"; col(2)[U]$="m"; '
+                   'wks.col1.type=4; wks.col2.type=1;')
+    assert unsafe == []
+
+
+def test_column_header_cmd_types():
+    cmd, _ = py2origin._column_header_cmd(
+        types=['y', 'ignore', 'y_err', 'x', 'label', 'z', 'X_ERR'])
+    assert cmd == ' '.join(f'wks.col{i}.type={i};' for i in range(1, 8))
+
+
+def test_column_header_cmd_unsafe_labels():
+    cmd, unsafe = py2origin._column_header_cmd(
+        long_names=['say "hi"', 'ok'],
+        units=['Cost $(USD)'],
+        comments=['100%'])
+    assert cmd == 'col(2)[L]$="ok";'
+    assert unsafe == [
+        (0, 'L', 'say "hi"'), (0, 'U', 'Cost $(USD)'), (0, 'C', '100%')]
+
+
+def test_set_column_labels():
+    class Column():
+        pass
+
+    columns = [Column(), Column()]
+
+    class Worksheet():
+        def Columns(self, idx):
+            return columns[idx]
+
+    py2origin._set_column_labels(
+        Worksheet(), [(1, 'L', 'say "hi"'), (0, 'U', 'Cost $(USD)')])
+    assert columns[1].LongName == 'say "hi"'
+    assert columns[0].Units == 'Cost $(USD)'
+
+
+def test_plot_style_cmds_line():
+    cmds = py2origin._plot_style_cmds(
+        'l', '#ff0000', '#00ff00', '#0000ff', ls='--', lw=1.5)
+    assert cmds == ['-d 1', '-cl color(#ff0000)', '-w 750']
+
+
+def test_plot_style_cmds_symbol():
+    cmds = py2origin._plot_style_cmds(
+        's', '#ff0000', '#00ff00', '#0000ff', marker='o', ms=6.0, mew=1.0)
+    assert cmds == ['-k 2', '-kf 2', '-z 6', '-c color(#00ff00)',
+                    '-csf color(#0000ff)', '-kh 10']
+
+
+def test_plot_style_cmds_line_symbol():
+    cmds = py2origin._plot_style_cmds(
+        'y', '#ff0000', '#00ff00', '#0000ff', marker='unknown', lw=2.0)
+    assert cmds == ['-k 0', '-kf 2', '-z 6', '-c color(#00ff00)',
+                    '-csf color(#0000ff)', '-kh 10',
+                    '-cl color(#ff0000)', '-w 1000']
+
+
+def test_origin_bulk_mode_registers_and_restores(monkeypatch):
+    registered = []
+    monkeypatch.setattr(py2origin.pythoncom, 'IID_IMessageFilter', 'iid',
+                        raising=False)
+    monkeypatch.setattr(py2origin.pythoncom, 'CoRegisterMessageFilter',
+                        lambda f: registered.append(f) or 'previous',
+                        raising=False)
+    with py2origin._origin_bulk_mode():
+        assert isinstance(registered[0], py2origin._BulkMessageFilter)
+    assert registered[1] == 'previous'
+
+
+def test_origin_bulk_mode_register_error(monkeypatch):
+    def register(f):
+        raise py2origin.pythoncom.com_error()
+
+    monkeypatch.setattr(py2origin.pythoncom, 'IID_IMessageFilter', 'iid',
+                        raising=False)
+    monkeypatch.setattr(py2origin.pythoncom, 'CoRegisterMessageFilter',
+                        register, raising=False)
+    with py2origin._origin_bulk_mode():
+        pass
+
+
+def test_errorbar_yerr_default_capsize():
+    fig, ax = plt.subplots()
+    container = ax.errorbar([1, 2, 3], [1, 2, 3], yerr=[0.1, 0.2, 0.3])
+    plt.close(fig)
+    assert container.lines[1] == ()  # no caplines with the default capsize
+    np.testing.assert_allclose(
+        py2origin._errorbar_yerr(container), [0.1, 0.2, 0.3])
+
+
+def test_errorbar_yerr_with_caps_and_xerr():
+    fig, ax = plt.subplots()
+    container = ax.errorbar([1, 2], [1, 2], xerr=[0.5, 0.5],
+                            yerr=[0.1, 0.2], capsize=5)
+    plt.close(fig)
+    np.testing.assert_allclose(
+        py2origin._errorbar_yerr(container), [0.1, 0.2])
+
+
+def test_errorbar_yerr_xerr_only():
+    fig, ax = plt.subplots()
+    container = ax.errorbar([1, 2], [1, 2], xerr=[0.5, 0.5])
+    plt.close(fig)
+    assert py2origin._errorbar_yerr(container) is None
+
+
+class FakeApplication():
+    MAINWND_SHOW = 1
+
+    def __init__(self):
+        self.alive = True
+
+    def Execute(self, cmd):
+        pass
+
+    def GetLTVar(self, name):
+        if not self.alive:
+            raise RuntimeError('session closed')
+        return 9.8
+
+
+def test_connect_to_origin_reuses_session(monkeypatch):
+    created = []
+    monkeypatch.setattr(py2origin, '_ORIGIN_SESSION', None)
+    monkeypatch.setattr(
+        py2origin.OriginExt, 'ApplicationSI',
+        lambda: created.append(FakeApplication()) or created[-1],
+        raising=False)
+    origin = py2origin.connect_to_origin()
+    assert py2origin.connect_to_origin() is origin
+    assert len(created) == 1
+
+
+def test_connect_to_origin_replaces_dead_session(monkeypatch):
+    created = []
+    monkeypatch.setattr(py2origin, '_ORIGIN_SESSION', None)
+    monkeypatch.setattr(
+        py2origin.OriginExt, 'ApplicationSI',
+        lambda: created.append(FakeApplication()) or created[-1],
+        raising=False)
+    origin = py2origin.connect_to_origin()
+    origin.alive = False
+    new_origin = py2origin.connect_to_origin()
+    assert new_origin is not origin
+    assert new_origin is created[1]
+    assert py2origin._ORIGIN_SESSION is new_origin
+
+
+class FakeAxis():
+    def get_units(self):
+        return 'mm'
+
+
+class FakeQuantity():
+    # Minimal stand-in for an astropy Quantity in metres
+    def __init__(self, value):
+        self.value = np.asarray(value)
+
+    def to(self, unit):
+        assert unit == 'mm'
+        return FakeQuantity(self.value * 1000)
+
+
+def test_axis_values_float_array_unchanged():
+    data = np.array([1.0, 2.0])
+    assert py2origin._axis_values(data, FakeAxis()) is data
+
+
+def test_axis_values_int_list():
+    values = py2origin._axis_values([1, 2], FakeAxis())
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, [1.0, 2.0])
+
+
+def test_axis_values_quantity():
+    values = py2origin._axis_values(FakeQuantity([1, 2]), FakeAxis())
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, [1000.0, 2000.0])
+
+
+def test_clean_label():
+    assert py2origin._clean_label(None) == ''
+    assert py2origin._clean_label('_child0') == ''
+    assert py2origin._clean_label('$\\alpha$') == '\\q(\\alpha)'
+    assert py2origin._clean_label('Time (s)') == 'Time (s)'
+
+
+class FakeWorkbook():
+    def __init__(self, name, sheets):
+        self.Name = name
+        self.Layers = sheets
+
+
+class FakeOrigin():
+    def __init__(self, workbooks):
+        self.workbooks = {wb.Name: wb for wb in workbooks}
+
+    def WorksheetPages(self, name):
+        return self.workbooks.get(name)
+
+
+def test_get_sheets_from_book_name():
+    origin = FakeOrigin([FakeWorkbook('Book1', ['s1', 's2'])])
+    assert py2origin.get_sheets_from_book(origin, 'Book1') == ['s1', 's2']
+
+
+def test_get_sheets_from_book_mixed_list():
+    book2 = FakeWorkbook('Book2', ['s3'])
+    origin = FakeOrigin([FakeWorkbook('Book1', ['s1', 's2'])])
+    assert py2origin.get_sheets_from_book(origin, ['Book1', book2]) == \
+        ['s1', 's2', 's3']
+
+
+def test_get_sheets_from_book_invalid():
+    origin = FakeOrigin([FakeWorkbook('Book1', ['s1'])])
+    # missing workbook and object without Layers are skipped
+    assert py2origin.get_sheets_from_book(
+        origin, ['Missing', object(), 'Book1']) == ['s1']
+
+
+class FakeWorksheet():
+    def __init__(self, book_name, sheet_name):
+        self.Parent = FakeWorkbook(book_name, [])
+        self.Name = sheet_name
+
+
+def test_multiwks_plot_cmds():
+    worksheets = [FakeWorksheet('Book1', 'Sheet1'),
+                  FakeWorksheet('Book2', 'Trig functions')]
+    scripts = py2origin._multiwks_plot_cmds(
+        worksheets, [0, 0], [1, 3], ['Line', 'Sym'])
+    assert scripts == [
+        'plotxy iy:=[Book1]"Sheet1"!(1,2) plot:=200 ogl:=<active>; '
+        'plotxy iy:=[Book2]"Trig functions"!(1,2) plot:=200 ogl:=<active>; '
+        'layer -g 1 2;',
+        'plotxy iy:=[Book1]"Sheet1"!(1,4) plot:=201 ogl:=<active>; '
+        'plotxy iy:=[Book2]"Trig functions"!(1,4) plot:=201 ogl:=<active>; '
+        'layer -g 3 4;',
+    ]
+
+
+def test_multiwks_plot_cmds_line_symbol():
+    scripts = py2origin._multiwks_plot_cmds(
+        [FakeWorksheet('Book1', 'Sheet1')], [2], [4], ['Line+Sym'])
+    assert scripts == [
+        'plotxy iy:=[Book1]"Sheet1"!(3,5) plot:=202 ogl:=<active>; '
+        'layer -g 1 1;']
+
+
+def test_multiwks_plot_cmds_unsafe_sheet_name():
+    with pytest.raises(ValueError):
+        py2origin._multiwks_plot_cmds(
+            [FakeWorksheet('Book1', 'say "hi"')], [0], [1], ['Line'])